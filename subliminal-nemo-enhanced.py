@@ -6,15 +6,34 @@
 # Una interfaz mejorada para descargar subtítulos desde Nemo
 
 import os
+import sys
 import subprocess
 import gettext
 import gi
 import json
+import queue
+import hashlib
+import re
+import time
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import functools
+import contextlib
+import collections
 from pathlib import Path
 
 gi.require_version('Gtk', '3.0')
-gi.require_version('Nemo', '3.0')
-from gi.repository import GObject, Gtk, Nemo, Gio, GLib, Pango
+from gi.repository import GObject, Gtk, Gdk, Gio, GLib, Pango
+
+try:
+    gi.require_version('Nemo', '3.0')
+    from gi.repository import Nemo
+except (ValueError, ImportError):
+    # Modo sin interfaz (CLI o servicio D-Bus): Nemo no está disponible
+    Nemo = None
 
 _ = gettext.gettext
 
@@ -30,11 +49,340 @@ DEFAULT_CONFIG = {
     'open_subtitles_username': '',
     'open_subtitles_password': '',
     'addic7ed_username': '',
-    'addic7ed_password': ''
+    'addic7ed_password': '',
+    # Máximo de archivos procesados en paralelo; el número real se ajusta solo
+    'max_workers': 4,
+    # Descargar una sola vez para enlaces duros y copias idénticas
+    'deduplicate': True,
+    # 'full' consulta todos los proveedores a la vez; 'early_exit' los consulta
+    # de uno en uno según su historial y para al encontrar subtítulos
+    'search_mode': 'full',
+    'early_exit_attempts': 2,
+    'early_exit_fallback': True,
+    # Mide el retraso del bucle principal de Nemo y la duración de los callbacks
+    'debug_instrumentation': False
 }
 
 CONFIG_FILE = os.path.expanduser('~/.config/subliminal-nemo/config.json')
 LOG_FILE = os.path.expanduser('~/.cache/subliminal-nemo/log.txt')
+PROVIDER_STATS_FILE = os.path.expanduser('~/.cache/subliminal-nemo/provider-stats.json')
+
+VIDEO_EXTENSIONS = ('.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.m4v', '.mpg', '.mpeg')
+SUBTITLE_EXTENSIONS = ('.srt', '.sub', '.ass', '.ssa', '.vtt')
+
+# Subliminal nombra los subtítulos con el código de dos letras del idioma
+LANGUAGE_ALPHA3 = {
+    'es': 'spa', 'en': 'eng', 'fr': 'fra', 'it': 'ita', 'pt': 'por',
+    'de': 'deu', 'ja': 'jpn', 'ko': 'kor', 'zh': 'zho', 'ru': 'rus',
+    'ar': 'ara', 'nl': 'nld', 'sv': 'swe', 'tr': 'tur', 'pl': 'pol',
+    'da': 'dan', 'fi': 'fin', 'no': 'nor', 'el': 'ell', 'hu': 'hun'
+}
+
+# Etiqueta de idioma en el nombre de un subtítulo: «en», «spa», «pt-BR»
+LANGUAGE_TAG_PATTERN = re.compile(r'^[a-z]{2,3}(-[a-z0-9]{2,4})?$', re.IGNORECASE)
+
+# Marcas que pueden seguir al idioma: «Movie.en.hi.srt» sigue siendo inglés
+SUBTITLE_FLAGS = {'hi', 'sdh', 'cc', 'forced'}
+
+# Comprobación previa: atributos consultados y consultas GIO simultáneas
+PREFLIGHT_ATTRIBUTES = 'standard::type,standard::size,unix::device,unix::inode'
+PREFLIGHT_BATCH = 32
+
+# Bytes copiados de los vídeos remotos sin ruta local (napiprojekt lee 10 MiB,
+# opensubtitles y bsplayer los primeros y últimos 64 KiB)
+STAGE_HEAD_BYTES = 10 * 1024 * 1024
+STAGE_TAIL_BYTES = 64 * 1024
+
+# Bytes leídos del principio y del final de un vídeo para detectar copias idénticas
+FINGERPRINT_BYTES = 64 * 1024
+
+COMPATIBLE_PROVIDERS = {
+    'addic7ed', 'bsplayer', 'gestdown', 'napiprojekt',
+    'opensubtitles', 'opensubtitlescom', 'opensubtitlescomvip',
+    'opensubtitlesvip', 'podnapisi', 'subtitulamos', 'tvsubtitles'
+}
+
+# Salida de subliminal que indica errores de red o limitación del proveedor
+THROTTLE_PATTERN = re.compile(
+    r'time(d)?\s*out|too many requests|\b429\b|\b503\b|rate.?limit|'
+    r'service unavailable|connection(error| reset| refused| aborted)',
+    re.IGNORECASE
+)
+
+# La latencia de referencia es la mediana de las últimas descargas correctas;
+# hacen falta varias descargas seguidas más lentas que la referencia por este
+# factor para considerar la conexión congestionada
+LATENCY_TOLERANCE = 3.0
+LATENCY_WINDOW = 20
+LATENCY_MIN_SAMPLES = 5
+LATENCY_SLOW_SAMPLES = 3
+
+# Proporción de búsquedas fallidas entre las últimas que reduce el límite
+ERROR_WINDOW = 10
+ERROR_MIN_SAMPLES = 4
+ERROR_RATE_LIMIT = 0.3
+
+# Búsqueda con salida temprana: latencia supuesta de un proveedor sin historial
+# (segundos) y peso de cada nueva medida en su media móvil
+DEFAULT_PROVIDER_LATENCY = 5.0
+LATENCY_SMOOTHING = 0.2
+
+# Servicio D-Bus de sesión que comparten la extensión, la CLI y las tareas cron
+DBUS_NAME = 'org.nemo.SubliminalNemo'
+DBUS_PATH = '/org/nemo/SubliminalNemo'
+DBUS_INTERFACE = 'org.nemo.SubliminalNemo'
+DBUS_SERVICE_FILE = os.path.expanduser(
+    '~/.local/share/dbus-1/services/org.nemo.SubliminalNemo.service'
+)
+DBUS_XML = """
+<node>
+  <interface name='org.nemo.SubliminalNemo'>
+    <method name='Download'>
+      <arg type='as' name='uris' direction='in'/>
+      <arg type='u' name='job_id' direction='out'/>
+    </method>
+    <signal name='Progress'>
+      <arg type='u' name='job_id'/>
+      <arg type='d' name='fraction'/>
+      <arg type='s' name='message'/>
+    </signal>
+    <signal name='Log'>
+      <arg type='u' name='job_id'/>
+      <arg type='s' name='line'/>
+    </signal>
+    <signal name='Concurrency'>
+      <arg type='u' name='job_id'/>
+      <arg type='u' name='level'/>
+    </signal>
+    <signal name='Finished'>
+      <arg type='u' name='job_id'/>
+      <arg type='u' name='succeeded'/>
+      <arg type='u' name='failed'/>
+    </signal>
+  </interface>
+</node>
+"""
+
+# Segundos sin trabajos antes de que el servicio termine por sí solo
+SERVICE_IDLE_TIMEOUT = 600
+
+# Instrumentación de depuración (también con SUBLIMINAL_NEMO_DEBUG=1)
+HEARTBEAT_INTERVAL_MS = 20
+INSTRUMENTATION_MAX_SAMPLES = 10000
+INSTRUMENTATION_REPORT_INTERVAL = 60
+
+# Orden que sustituye a subliminal, p. ej. para el banco de pruebas
+SUBLIMINAL_COMMAND_ENV = 'SUBLIMINAL_NEMO_SUBLIMINAL'
+
+
+def log_error(message):
+    """Registra un mensaje de error en el archivo de registro"""
+    try:
+        with open(LOG_FILE, 'a') as f:
+            f.write(f"{message}\n")
+    except:
+        pass
+
+
+def load_config():
+    """Carga la configuración desde el archivo o usa valores por defecto"""
+    if not os.path.exists(CONFIG_FILE):
+        return DEFAULT_CONFIG.copy()
+
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+
+            # Asegurarse de que todos los valores por defecto estén presentes
+            for key, value in DEFAULT_CONFIG.items():
+                if key not in config:
+                    config[key] = value
+
+            # Filtrar proveedores no compatibles
+            if 'providers' in config:
+                filtered_providers = [p for p in config['providers'] if p in COMPATIBLE_PROVIDERS]
+
+                # Si no quedan proveedores compatibles, usar los predeterminados
+                if not filtered_providers:
+                    config['providers'] = DEFAULT_CONFIG['providers']
+                else:
+                    config['providers'] = filtered_providers
+
+            return config
+
+    except Exception as e:
+        log_error(f"Error al cargar la configuración: {str(e)}")
+        return DEFAULT_CONFIG.copy()
+
+
+def save_config(config):
+    """Guarda la configuración en el archivo"""
+    try:
+        with open(CONFIG_FILE, 'w') as f:
+            json.dump(config, f, indent=4)
+        return True
+    except Exception as e:
+        log_error(f"Error al guardar la configuración: {str(e)}")
+        return False
+
+
+def setup_directories():
+    """Crea los directorios necesarios si no existen"""
+    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+
+
+def install_dbus_service():
+    """Instala el archivo de activación D-Bus que arranca el servicio bajo demanda
+
+    Escribe DBUS_SERVICE_FILE (~/.local/share/dbus-1/services/org.nemo.SubliminalNemo.service).
+    Solo se llama desde «subliminal-nemo install-service»; sin él, la extensión
+    y la CLI usan una cola local. Se elimina con «subliminal-nemo uninstall-service».
+    """
+    command = [shutil.which('python3') or '/usr/bin/python3', os.path.abspath(__file__), 'serve']
+    content = (
+        "[D-BUS Service]\n"
+        f"Name={DBUS_NAME}\n"
+        f"Exec={' '.join(shlex.quote(argument) for argument in command)}\n"
+    )
+    try:
+        if os.path.exists(DBUS_SERVICE_FILE):
+            with open(DBUS_SERVICE_FILE, 'r') as f:
+                if f.read() == content:
+                    return True
+        os.makedirs(os.path.dirname(DBUS_SERVICE_FILE), exist_ok=True)
+        with open(DBUS_SERVICE_FILE, 'w') as f:
+            f.write(content)
+        return True
+    except Exception as e:
+        log_error(f"Error al instalar el servicio D-Bus: {str(e)}")
+        return False
+
+
+def uninstall_dbus_service():
+    """Elimina el archivo de activación D-Bus instalado por install_dbus_service"""
+    try:
+        if os.path.exists(DBUS_SERVICE_FILE):
+            os.remove(DBUS_SERVICE_FILE)
+        return True
+    except Exception as e:
+        log_error(f"Error al desinstalar el servicio D-Bus: {str(e)}")
+        return False
+
+
+def percentile(values, percent):
+    """Percentil por el método del rango más cercano; 0 si no hay valores"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Instrumentation:
+    """Modo de depuración: mide el retraso del bucle principal y la duración de los callbacks
+
+    El retraso se obtiene de un temporizador periódico: lo que tarde en
+    dispararse por encima de su intervalo es tiempo en que el bucle principal
+    estuvo bloqueado.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stalls = collections.deque(maxlen=INSTRUMENTATION_MAX_SAMPLES)
+        self.callbacks = {}
+        self._lock = threading.Lock()
+        self._heartbeat_id = None
+        self._last_beat = None
+
+    def enable(self):
+        self.enabled = True
+
+    def start_heartbeat(self, interval_ms=HEARTBEAT_INTERVAL_MS):
+        """Arranca el temporizador que mide el retraso del bucle principal"""
+        if self._heartbeat_id is not None:
+            return
+        self._last_beat = time.monotonic()
+        self._heartbeat_id = GLib.timeout_add(interval_ms, self._on_heartbeat, interval_ms)
+
+    def stop_heartbeat(self):
+        if self._heartbeat_id is not None:
+            GLib.source_remove(self._heartbeat_id)
+            self._heartbeat_id = None
+
+    def _on_heartbeat(self, interval_ms):
+        now = time.monotonic()
+        lag = (now - self._last_beat) * 1000 - interval_ms
+        self._last_beat = now
+        with self._lock:
+            self.stalls.append(max(0.0, lag))
+        return True
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Registra la duración del bloque con el nombre indicado"""
+        if not self.enabled:
+            yield
+            return
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = (time.monotonic() - started) * 1000
+            with self._lock:
+                samples = self.callbacks.get(name)
+                if samples is None:
+                    samples = self.callbacks[name] = collections.deque(maxlen=INSTRUMENTATION_MAX_SAMPLES)
+                samples.append(elapsed)
+
+    def report(self):
+        """Resumen en milisegundos: {serie: {'count', 'p50', 'p99', 'max'}}"""
+        with self._lock:
+            series = {'main_loop_stall': list(self.stalls)}
+            for name, samples in self.callbacks.items():
+                series[name] = list(samples)
+
+        return {
+            name: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p99': percentile(values, 99),
+                'max': max(values) if values else 0.0
+            }
+            for name, values in series.items()
+        }
+
+    def format_report(self):
+        lines = []
+        for name, summary in sorted(self.report().items()):
+            lines.append(
+                f"{name}: n={summary['count']} p50={summary['p50']:.1f}ms "
+                f"p99={summary['p99']:.1f}ms max={summary['max']:.1f}ms"
+            )
+        return "\n".join(lines)
+
+    def log_report(self):
+        """Escribe el resumen en el archivo de registro; apto como callback periódico"""
+        log_error(f"Instrumentación:\n{self.format_report()}")
+        return True
+
+
+instrumentation = Instrumentation()
+
+
+def instrumented(name):
+    """Decorador que mide un callback cuando la instrumentación está activa"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+            with instrumentation.measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 class SubliminalConfigDialog(Gtk.Dialog):
     def __init__(self, parent, config):
@@ -160,6 +508,35 @@ class SubliminalConfigDialog(Gtk.Dialog):
             self.hearing_impaired_switch
         )
         
+        # Búsqueda con salida temprana
+        self.early_exit_switch = Gtk.Switch()
+        self.early_exit_switch.set_active(self.config.get('search_mode', 'full') == 'early_exit')
+        self._add_setting_row(
+            box,
+            _("Búsqueda rápida"),
+            _("Consultar primero los proveedores con más aciertos y parar al encontrar subtítulos"),
+            self.early_exit_switch
+        )
+        
+        self.early_exit_fallback_switch = Gtk.Switch()
+        self.early_exit_fallback_switch.set_active(self.config.get('early_exit_fallback', True))
+        self._add_setting_row(
+            box,
+            _("Búsqueda completa si no hay resultados"),
+            _("Consultar el resto de proveedores si la búsqueda rápida no encuentra subtítulos"),
+            self.early_exit_fallback_switch
+        )
+        
+        # Detectar duplicados
+        self.deduplicate_switch = Gtk.Switch()
+        self.deduplicate_switch.set_active(self.config.get('deduplicate', True))
+        self._add_setting_row(
+            box,
+            _("Detectar duplicados"),
+            _("Buscar una sola vez para enlaces duros y copias idénticas del mismo vídeo"),
+            self.deduplicate_switch
+        )
+        
         # Puntuación mínima
         score_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
         self.min_score = Gtk.SpinButton.new_with_range(0, 100, 1)
@@ -176,6 +553,24 @@ class SubliminalConfigDialog(Gtk.Dialog):
         score_row.add(score_box)
         box.pack_start(score_row, False, False, 0)
         
+        # Máximo de descargas simultáneas
+        workers_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        self.max_workers = Gtk.SpinButton.new_with_range(1, 16, 1)
+        self.max_workers.set_value(self.config.get('max_workers', 4))
+        self.max_workers.set_halign(Gtk.Align.START)
+        
+        workers_label = Gtk.Label(label=_("Descargas simultáneas (máximo)"))
+        workers_label.set_tooltip_text(
+            _("El número real se ajusta solo según la latencia y los errores de los proveedores")
+        )
+        
+        workers_box.pack_start(workers_label, False, False, 0)
+        workers_box.pack_end(self.max_workers, False, False, 0)
+        
+        workers_row = Gtk.ListBoxRow()
+        workers_row.add(workers_box)
+        box.pack_start(workers_row, False, False, 0)
+        
         return box
     
     def _create_languages_tab(self):
@@ -470,7 +865,11 @@ class SubliminalConfigDialog(Gtk.Dialog):
         config['force'] = self.force_switch.get_active()
         config['single'] = self.single_switch.get_active()
         config['hearing_impaired'] = self.hearing_impaired_switch.get_active()
+        config['deduplicate'] = self.deduplicate_switch.get_active()
+        config['search_mode'] = 'early_exit' if self.early_exit_switch.get_active() else 'full'
+        config['early_exit_fallback'] = self.early_exit_fallback_switch.get_active()
         config['min_score'] = int(self.min_score.get_value())
+        config['max_workers'] = int(self.max_workers.get_value())
         
         # Credenciales
         config['open_subtitles_username'] = self.os_username.get_text().strip()
@@ -503,7 +902,11 @@ class SubliminalConfigDialog(Gtk.Dialog):
         config['force'] = self.force_switch.get_active()
         config['single'] = self.single_switch.get_active()
         config['hearing_impaired'] = self.hearing_impaired_switch.get_active()
+        config['deduplicate'] = self.deduplicate_switch.get_active()
+        config['search_mode'] = 'early_exit' if self.early_exit_switch.get_active() else 'full'
+        config['early_exit_fallback'] = self.early_exit_fallback_switch.get_active()
         config['min_score'] = self.min_score.get_value_as_int()
+        config['max_workers'] = self.max_workers.get_value_as_int()
         
         # Idiomas seleccionados
         config['languages'] = [
@@ -523,253 +926,1436 @@ class SubliminalConfigDialog(Gtk.Dialog):
         return config
 
 
-class SubliminalExtension(GObject.GObject, Nemo.MenuProvider):
+class JobListener:
+    """Recibe los eventos de un trabajo de descarga"""
+
+    def on_progress(self, job_id, fraction, message):
+        pass
+
+    def on_log(self, job_id, line):
+        pass
+
+    def on_concurrency(self, job_id, level):
+        pass
+
+    def on_finished(self, job_id, succeeded, failed):
+        pass
+
+
+class MainLoopListener(JobListener):
+    """Reenvía los eventos de los hilos de trabajo al bucle principal de GLib"""
+
+    def __init__(self, listener):
+        self.listener = listener
+
+    def on_progress(self, job_id, fraction, message):
+        GLib.idle_add(self.listener.on_progress, job_id, fraction, message)
+
+    def on_log(self, job_id, line):
+        GLib.idle_add(self.listener.on_log, job_id, line)
+
+    def on_concurrency(self, job_id, level):
+        GLib.idle_add(self.listener.on_concurrency, job_id, level)
+
+    def on_finished(self, job_id, succeeded, failed):
+        GLib.idle_add(self.listener.on_finished, job_id, succeeded, failed)
+
+
+class DownloadJob:
+    """Selección de archivos enviada a la cola de descargas"""
+
+    def __init__(self, job_id, uris, listener):
+        self.job_id = job_id
+        self.uris = list(uris)
+        self.listener = listener
+        self.total = 0
+        self.completed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+
+class AdaptiveConcurrency:
+    """Límite de descargas simultáneas ajustado con AIMD
+
+    Cada ventana de descargas correctas y rápidas suma un hilo hasta el
+    máximo configurado; un error de red, una limitación del proveedor, una
+    tasa alta de búsquedas fallidas o varias latencias seguidas muy
+    superiores a la mediana reciente reducen el límite a la mitad. La
+    latencia de las búsquedas fallidas no se tiene en cuenta.
+    """
+
+    def __init__(self, ceiling, initial=2):
+        self.ceiling = max(1, ceiling)
+        self.limit = max(1, min(initial, self.ceiling))
+        self._active = 0
+        self._successes = 0
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._slow_streak = 0
+        self._outcomes = collections.deque(maxlen=ERROR_WINDOW)
+        self._condition = threading.Condition()
+
+    def set_ceiling(self, ceiling):
+        """Actualiza el máximo configurado sin perder lo aprendido"""
+        with self._condition:
+            self.ceiling = max(1, ceiling)
+            self.limit = min(self.limit, self.ceiling)
+            self._condition.notify_all()
+
+    def acquire(self):
+        """Espera hasta que haya un hueco libre por debajo del límite actual"""
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, latency=None, success=True, congested=False):
+        """Libera un hueco y ajusta el límite; devuelve el nuevo límite si ha cambiado
+
+        Sin latencia (p. ej. no quedaba trabajo) el límite no cambia.
+        """
+        with self._condition:
+            self._active -= 1
+            previous = self.limit
+
+            if latency is not None:
+                self._outcomes.append(success)
+                failures = self._outcomes.count(False)
+                if (len(self._outcomes) >= ERROR_MIN_SAMPLES
+                        and failures / len(self._outcomes) >= ERROR_RATE_LIMIT):
+                    congested = True
+
+            if latency is not None and success:
+                if len(self._latencies) >= LATENCY_MIN_SAMPLES:
+                    baseline = percentile(self._latencies, 50)
+                    if latency > baseline * LATENCY_TOLERANCE:
+                        self._slow_streak += 1
+                    else:
+                        self._slow_streak = 0
+
+                    if self._slow_streak >= LATENCY_SLOW_SAMPLES:
+                        congested = True
+
+                # Las descargas lentas también entran: la referencia sigue a la conexión
+                self._latencies.append(latency)
+
+            if congested:
+                self._slow_streak = 0
+                self._outcomes.clear()
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            elif latency is not None and success:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit = min(self.ceiling, self.limit + 1)
+                    self._successes = 0
+
+            self._condition.notify_all()
+            return self.limit if self.limit != previous else None
+
+
+class VideoEntry:
+    """Archivo de vídeo validado en la comprobación previa de un trabajo"""
+
+    def __init__(self, location, info):
+        self.location = location
+        self.uri = location.get_uri()
+        self.name = location.get_basename()
+        self.size = info.get_size()
+        self.device = info.get_attribute_uint32('unix::device')
+        self.inode = info.get_attribute_uint64('unix::inode')
+
+        # Ruta local; en montajes gvfs es la ruta FUSE si existe
+        self.path = location.get_path()
+
+        # Otros archivos del trabajo con el mismo contenido
+        self.duplicates = []
+
+        # Subtítulos que hay junto al vídeo tras la descarga
+        self.sidecars = []
+
+        # Búsquedas por idioma pendientes y fallidas
+        self.pending_units = 0
+        self.failed_units = 0
+
+        # Copia local de un vídeo remoto, compartida por sus búsquedas
+        self.staged_path = None
+        self.lock = threading.Lock()
+
+
+def is_sidecar(name, stem):
+    """Indica si un nombre es un subtítulo del vídeo: «stem.ext» o «stem.idioma[-REGIÓN][.marca].ext»
+
+    Otros vídeos que empiecen igual (Movie.2020.1080p.en.srt para
+    Movie.2020.mkv) no cuentan.
+    """
+    if not name.startswith(stem + '.') or not name.lower().endswith(SUBTITLE_EXTENSIONS):
+        return False
+
+    parts = name[len(stem) + 1:].split('.')
+    if len(parts) == 1:
+        return True
+    if len(parts) == 3 and parts[1].lower() not in SUBTITLE_FLAGS:
+        return False
+    return len(parts) <= 3 and bool(LANGUAGE_TAG_PATTERN.match(parts[0]))
+
+
+def list_sidecars(directory, stem):
+    """Devuelve {nombre: mtime} de los subtítulos de un vídeo en un directorio"""
+    sidecars = {}
+    try:
+        with os.scandir(directory) as it:
+            for item in it:
+                if is_sidecar(item.name, stem) and item.is_file():
+                    sidecars[item.name] = item.stat().st_mtime
+    except OSError:
+        pass
+    return sidecars
+
+
+def sidecar_language(name, stem):
+    """Idioma (código de tres letras) de un subtítulo aceptado por is_sidecar, o None
+    si el nombre no lo indica"""
+    parts = name[len(stem) + 1:].split('.')
+    if len(parts) < 2:
+        return None
+
+    code = parts[0].split('-')[0].lower()
+    return LANGUAGE_ALPHA3.get(code, code)
+
+
+def changed_sidecars(before, after):
+    """Nombres de los subtítulos creados o reescritos entre dos llamadas a list_sidecars"""
+    return [name for name, mtime in after.items() if before.get(name) != mtime]
+
+
+def read_stream(stream, count):
+    """Lee hasta count bytes de un GInputStream, que puede devolver lecturas parciales"""
+    chunks = []
+    while count > 0:
+        data = stream.read_bytes(min(count, 1024 * 1024), None).get_data()
+        if not data:
+            break
+        chunks.append(data)
+        count -= len(data)
+    return b''.join(chunks)
+
+
+def stage_remote_file(entry):
+    """Crea una copia local dispersa de un vídeo remoto, suficiente para calcular sus hashes
+
+    Solo se copian el principio y el final del archivo, que es lo que leen
+    los algoritmos de hash de los proveedores. Devuelve la ruta de la copia.
+    """
+    staging_dir = tempfile.mkdtemp(prefix='subliminal-nemo-')
+    staged_path = os.path.join(staging_dir, entry.name)
+
+    try:
+        stream = entry.location.read(None)
+        try:
+            with open(staged_path, 'wb') as f:
+                f.truncate(entry.size)
+
+                head = read_stream(stream, min(entry.size, STAGE_HEAD_BYTES))
+                f.write(head)
+
+                tail_offset = max(len(head), entry.size - STAGE_TAIL_BYTES)
+                if tail_offset < entry.size:
+                    stream.seek(tail_offset, GLib.SeekType.SET, None)
+                    f.seek(tail_offset)
+                    f.write(read_stream(stream, entry.size - tail_offset))
+        finally:
+            stream.close(None)
+    except BaseException:
+        # Sin copia no hay staged_path que limpiar después: borrarla aquí
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    return staged_path
+
+
+def publish_staged_sidecars(entry, staged_path):
+    """Copia junto al vídeo remoto los subtítulos generados para su copia local"""
+    staging_dir = os.path.dirname(staged_path)
+    stem = os.path.splitext(entry.name)[0]
+    parent = entry.location.get_parent()
+    published = []
+
+    for name in list_sidecars(staging_dir, stem):
+        source = Gio.File.new_for_path(os.path.join(staging_dir, name))
+        source.copy(parent.get_child(name), Gio.FileCopyFlags.OVERWRITE, None, None, None)
+        published.append(name)
+
+    return published
+
+
+def content_fingerprint(entry):
+    """Huella del contenido: tamaño más el principio y el final del archivo
+
+    Es lo mismo que usan los hashes de los proveedores, así que dos archivos
+    con la misma huella reciben los mismos subtítulos.
+    """
+    digest = hashlib.sha1(str(entry.size).encode())
+
+    if entry.path is not None:
+        with open(entry.path, 'rb') as f:
+            digest.update(f.read(FINGERPRINT_BYTES))
+            f.seek(max(0, entry.size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+        return digest.hexdigest()
+
+    stream = entry.location.read(None)
+    try:
+        digest.update(read_stream(stream, FINGERPRINT_BYTES))
+        stream.seek(max(0, entry.size - FINGERPRINT_BYTES), GLib.SeekType.SET, None)
+        digest.update(read_stream(stream, FINGERPRINT_BYTES))
+    finally:
+        stream.close(None)
+    return digest.hexdigest()
+
+
+def share_sidecars(entry, duplicate, names, overwrite):
+    """Enlaza o copia los subtítulos de un vídeo junto a un duplicado suyo
+
+    Devuelve dos listas: los nombres creados junto al duplicado y los que ya
+    tenía y no se han sobrescrito.
+    """
+    stem = os.path.splitext(entry.name)[0]
+    duplicate_stem = os.path.splitext(duplicate.name)[0]
+    source_dir = entry.location.get_parent()
+    target_dir = duplicate.location.get_parent()
+    shared = []
+    existing = []
+
+    for name in names:
+        target_name = duplicate_stem + name[len(stem):]
+        source = source_dir.get_child(name)
+        target = target_dir.get_child(target_name)
+        source_path = source.get_path()
+        target_path = target.get_path()
+
+        # Montajes duplicados del mismo directorio: el subtítulo ya está ahí
+        if (source_path is not None and target_path is not None
+                and os.path.exists(target_path) and os.path.samefile(source_path, target_path)):
+            shared.append(target_name)
+            continue
+
+        if target.query_exists(None):
+            if not overwrite:
+                existing.append(target_name)
+                continue
+            target.delete(None)
+
+        try:
+            if source_path is None or target_path is None:
+                raise OSError("sin ruta local")
+            os.link(source_path, target_path)
+        except OSError:
+            # Distinto sistema de archivos o ubicación remota: copiar
+            source.copy(target, Gio.FileCopyFlags.OVERWRITE, None, None, None)
+
+        shared.append(target_name)
+
+    return shared, existing
+
+
+class ProviderStats:
+    """Estadísticas persistentes de aciertos y latencia por proveedor e idioma"""
+
+    def __init__(self, path=PROVIDER_STATS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, 'r') as f:
+                self._stats = json.load(f)
+        except (OSError, ValueError):
+            self._stats = {}
+
+    def _default_latency(self):
+        """Latencia media registrada, usada para los proveedores sin historial"""
+        latencies = [
+            entry['latency']
+            for languages in self._stats.values()
+            for entry in languages.values()
+        ]
+        return sum(latencies) / len(latencies) if latencies else DEFAULT_PROVIDER_LATENCY
+
+    def _score(self, provider, languages, default_latency):
+        """Aciertos esperados por segundo de búsqueda"""
+        scores = []
+        for language in languages:
+            entry = self._stats.get(provider, {}).get(language, {})
+            attempts = entry.get('attempts', 0)
+            hits = entry.get('hits', 0)
+            latency = entry.get('latency', default_latency)
+
+            # Suavizado de Laplace: un proveedor sin historial parte de un 50 %
+            scores.append((hits + 1) / (attempts + 2) / max(latency, 0.1))
+
+        return sum(scores) / len(scores) if scores else 0.0
+
+    def order(self, providers, languages):
+        """Ordena los proveedores del más al menos prometedor; en caso de empate conserva el orden"""
+        with self._lock:
+            default_latency = self._default_latency()
+            return sorted(
+                providers,
+                key=lambda provider: self._score(provider, languages, default_latency),
+                reverse=True
+            )
+
+    def record(self, provider, languages, hits, latency):
+        """Registra una consulta a un proveedor y los idiomas que encontró"""
+        with self._lock:
+            for language in languages:
+                entry = self._stats.setdefault(provider, {}).setdefault(
+                    language,
+                    {'attempts': 0, 'hits': 0, 'latency': latency}
+                )
+                entry['attempts'] += 1
+                if language in hits:
+                    entry['hits'] += 1
+                entry['latency'] += (latency - entry['latency']) * LATENCY_SMOOTHING
+            self._dirty = True
+
+    def save(self):
+        """Guarda las estadísticas si han cambiado"""
+        with self._lock:
+            if not self._dirty:
+                return
+
+            try:
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w') as f:
+                    json.dump(self._stats, f, indent=4)
+                os.replace(temp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                log_error(f"Error al guardar las estadísticas de proveedores: {str(e)}")
+
+
+def list_directory(directory):
+    """Nombres de los archivos de un directorio local o remoto"""
+    path = directory.get_path()
+    try:
+        if path is not None:
+            return os.listdir(path)
+
+        names = []
+        enumerator = directory.enumerate_children('standard::name', Gio.FileQueryInfoFlags.NONE, None)
+        info = enumerator.next_file(None)
+        while info is not None:
+            names.append(info.get_name())
+            info = enumerator.next_file(None)
+        enumerator.close(None)
+        return names
+    except (OSError, GLib.Error):
+        return []
+
+
+class SubtitleIndex:
+    """Índice de los subtítulos que ya hay junto a los vídeos de un trabajo
+
+    Cada directorio se lista una sola vez.
+    """
+
     def __init__(self):
-        self.config = self.load_config()
-        self.setup_directories()
-    
-    def setup_directories(self):
-        """Crea los directorios necesarios si no existen"""
-        os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-    
-    def load_config(self):
-        """Carga la configuración desde el archivo o usa valores por defecto"""
-        if not os.path.exists(CONFIG_FILE):
-            return DEFAULT_CONFIG.copy()
-            
+        self._directories = {}
+
+    def sidecars(self, entry):
+        """Nombres de los subtítulos que ya existen para un vídeo"""
+        directory = entry.location.get_parent()
+        uri = directory.get_uri()
+        names = self._directories.get(uri)
+        if names is None:
+            names = self._directories[uri] = list_directory(directory)
+
+        stem = os.path.splitext(entry.name)[0]
+        return sorted(name for name in names if is_sidecar(name, stem))
+
+    def languages(self, entry):
+        """Idiomas con subtítulo; None representa un subtítulo sin idioma en el nombre"""
+        stem = os.path.splitext(entry.name)[0]
+        return {sidecar_language(name, stem) for name in self.sidecars(entry)}
+
+
+class WorkUnit:
+    """Búsqueda de subtítulos para un vídeo en uno o varios idiomas"""
+
+    def __init__(self, entry, languages, rank):
+        self.entry = entry
+        self.languages = languages
+        # Posición del idioma en las preferencias: los preferidos se atienden antes
+        self.rank = rank
+
+
+class SubliminalPipeline:
+    """Cola de descargas compartida por la extensión, la CLI y el servicio D-Bus
+
+    Los trabajos se ejecutan uno tras otro; los archivos de cada trabajo se
+    reparten entre varios hilos cuyo número se ajusta con AdaptiveConcurrency.
+    Los eventos del listener se emiten desde esos hilos.
+
+    Entre trabajos solo se conservan la cola, el límite de concurrencia, la
+    configuración, la orden de subliminal y las estadísticas de proveedores:
+    cada búsqueda lanza su propio proceso de subliminal, así que las sesiones
+    de los proveedores y el análisis de los vídeos no se reutilizan.
+    """
+
+    def __init__(self, config=None):
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_job_id = 1
+        self._pending = 0
+        self._dispatcher = None
+        self._fixed_config = config
+        self._config = None
+        self._config_mtime = None
+        self._command = None
+        self._concurrency = None
+        self._provider_stats = None
+
+    @property
+    def config(self):
+        """Configuración en caché; solo se relee si el archivo ha cambiado"""
+        if self._fixed_config is not None:
+            return self._fixed_config
+
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                
-                # Asegurarse de que todos los valores por defecto estén presentes
-                for key, value in DEFAULT_CONFIG.items():
-                    if key not in config:
-                        config[key] = value
-                
-                # Filtrar proveedores no compatibles
-                if 'providers' in config:
-                    compatible_providers = {
-                        'addic7ed', 'bsplayer', 'gestdown', 'napiprojekt', 
-                        'opensubtitles', 'opensubtitlescom', 'opensubtitlescomvip', 
-                        'opensubtitlesvip', 'podnapisi', 'subtitulamos', 'tvsubtitles'
-                    }
-                    
-                    # Filtrar solo proveedores compatibles
-                    filtered_providers = [p for p in config['providers'] if p in compatible_providers]
-                    
-                    # Si no quedan proveedores compatibles, usar los predeterminados
-                    if not filtered_providers:
-                        config['providers'] = DEFAULT_CONFIG['providers']
-                    else:
-                        config['providers'] = filtered_providers
-                
-                return config
-                
-        except Exception as e:
-            self.log_error(f"Error al cargar la configuración: {str(e)}")
-            return DEFAULT_CONFIG.copy()
-    
-    def save_config(self, config):
-        """Guarda la configuración en el archivo"""
+            mtime = os.path.getmtime(CONFIG_FILE)
+        except OSError:
+            mtime = None
+
+        with self._lock:
+            if self._config is None or mtime != self._config_mtime:
+                self._config = load_config()
+                self._config_mtime = mtime
+            return self._config
+
+    @property
+    def subliminal_command(self):
+        """Orden de subliminal, resuelta una sola vez"""
+        if self._command is None:
+            override = os.environ.get(SUBLIMINAL_COMMAND_ENV)
+            if override:
+                self._command = shlex.split(override)
+            else:
+                self._command = [shutil.which('subliminal') or 'subliminal']
+        return self._command
+
+    @property
+    def provider_stats(self):
+        """Estadísticas de proveedores, cargadas una sola vez por proceso"""
+        with self._lock:
+            if self._provider_stats is None:
+                self._provider_stats = ProviderStats()
+            return self._provider_stats
+
+    def is_idle(self):
+        """Indica si no hay trabajos en cola ni en ejecución"""
+        with self._lock:
+            return self._pending == 0
+
+    def create_job(self, uris, listener):
+        """Reserva un identificador para un trabajo sin encolarlo todavía"""
+        with self._lock:
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            self._pending += 1
+        return DownloadJob(job_id, uris, listener)
+
+    def enqueue(self, job):
+        """Encola un trabajo creado con create_job"""
+        with self._lock:
+            if self._dispatcher is None or not self._dispatcher.is_alive():
+                self._dispatcher = threading.Thread(target=self._dispatch_loop)
+                self._dispatcher.daemon = True
+                self._dispatcher.start()
+        self._jobs.put(job)
+
+    def submit(self, uris, listener):
+        """Crea y encola un trabajo; devuelve su identificador"""
+        job = self.create_job(uris, listener)
+        self.enqueue(job)
+        return job.job_id
+
+    def _dispatch_loop(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                self._run_job(job)
+            except Exception as e:
+                log_error(f"Error en el trabajo {job.job_id}: {str(e)}")
+                job.listener.on_log(job.job_id, f"✗ Error inesperado: {str(e)}")
+                job.failed = job.total - job.succeeded
+            finally:
+                job.listener.on_finished(job.job_id, job.succeeded, job.failed)
+                with self._lock:
+                    self._pending -= 1
+
+    def _preflight(self, job):
+        """Valida las URIs del trabajo con consultas GIO asíncronas por lotes
+
+        Las URIs inaccesibles o que no son archivos cuentan como fallidas.
+        """
+        entries = [None] * len(job.uris)
+        pending = [0]
+
+        def on_info(location, result, index):
+            pending[0] -= 1
+            try:
+                info = location.query_info_finish(result)
+            except GLib.Error as e:
+                job.listener.on_log(job.job_id, f"✗ No se puede acceder a {location.get_uri()}: {e.message}")
+                info = None
+
+            if info is not None and info.get_file_type() == Gio.FileType.REGULAR:
+                entries[index] = VideoEntry(location, info)
+                return
+
+            if info is not None:
+                job.listener.on_log(job.job_id, f"✗ {location.get_uri()} no es un archivo")
+            with job.lock:
+                job.completed += 1
+                job.failed += 1
+
+        # Las respuestas se atienden en un contexto propio de este hilo
+        context = GLib.MainContext.new()
+        context.push_thread_default()
+        try:
+            index = 0
+            while index < len(job.uris) or pending[0]:
+                while index < len(job.uris) and pending[0] < PREFLIGHT_BATCH:
+                    location = Gio.File.new_for_uri(job.uris[index])
+                    location.query_info_async(
+                        PREFLIGHT_ATTRIBUTES,
+                        Gio.FileQueryInfoFlags.NONE,
+                        GLib.PRIORITY_DEFAULT,
+                        None,
+                        on_info,
+                        index
+                    )
+                    pending[0] += 1
+                    index += 1
+                context.iteration(True)
+        finally:
+            context.pop_thread_default()
+
+        return [entry for entry in entries if entry is not None]
+
+    def _deduplicate(self, job, entries):
+        """Agrupa enlaces duros y copias idénticas; devuelve un vídeo por grupo"""
+        # Primero por (dispositivo, inodo): enlaces duros y montajes duplicados
+        by_inode = {}
+        candidates = []
+        for entry in entries:
+            key = (entry.device, entry.inode) if entry.inode else None
+            if key in by_inode:
+                by_inode[key].duplicates.append(entry)
+                continue
+            if key is not None:
+                by_inode[key] = entry
+            candidates.append(entry)
+
+        # Después por contenido, solo entre archivos del mismo tamaño
+        sizes = {}
+        for entry in candidates:
+            sizes[entry.size] = sizes.get(entry.size, 0) + 1
+
+        by_content = {}
+        unique = []
+        for entry in candidates:
+            if sizes[entry.size] > 1:
+                try:
+                    key = content_fingerprint(entry)
+                except (OSError, GLib.Error):
+                    key = None
+
+                if key in by_content:
+                    first = by_content[key]
+                    first.duplicates.append(entry)
+                    first.duplicates.extend(entry.duplicates)
+                    entry.duplicates = []
+                    continue
+                if key is not None:
+                    by_content[key] = entry
+            unique.append(entry)
+
+        duplicates = len(entries) - len(unique)
+        if duplicates:
+            job.listener.on_log(job.job_id, f"Duplicados detectados: {duplicates}")
+        return unique
+
+    def _expand_units(self, job, entries, config):
+        """Divide los vídeos en búsquedas por idioma, omitiendo los idiomas que ya tienen"""
+        preferences = list(config['languages'])
+        index = SubtitleIndex()
+        units = []
+
+        for entry in entries:
+            entry.sidecars = index.sidecars(entry)
+            present = set() if config['force'] else index.languages(entry)
+
+            if config['single']:
+                # --single escribe un único archivo sin idioma: basta con ese o con
+                # uno de los idiomas pedidos, no con el de otro idioma
+                done = None in present or any(language in present for language in preferences)
+                groups = [] if done else [preferences]
+            else:
+                missing = [language for language in preferences if language not in present]
+                if len(missing) == len(preferences):
+                    # Nada que omitir: un solo proceso busca todos los idiomas a la vez
+                    # con un único análisis del vídeo y una sesión por proveedor
+                    groups = [missing]
+                else:
+                    groups = [[language] for language in missing]
+
+            entry.pending_units = len(groups)
+            for languages in groups:
+                units.append(WorkUnit(entry, languages, preferences.index(languages[0])))
+
+        skipped = len(entries) * len(preferences) - sum(len(unit.languages) for unit in units)
+        if skipped and not config['single']:
+            job.listener.on_log(job.job_id, f"Idiomas que ya tenían subtítulos: {skipped}")
+        return units
+
+    def _run_job(self, job):
+        config = self.config
+        job.total = len(job.uris)
+        entries = self._preflight(job)
+
+        if config.get('deduplicate', True):
+            entries = self._deduplicate(job, entries)
+
+        units = self._expand_units(job, entries, config)
+        for entry in entries:
+            if entry.pending_units == 0:
+                job.listener.on_log(job.job_id, f"✓ {entry.name} ya tiene subtítulos")
+                self._finish_entry(job, entry, config)
+
+        # El límite aprendido se conserva entre trabajos del mismo proceso
+        ceiling = int(config.get('max_workers', 1))
+        if self._concurrency is None:
+            self._concurrency = AdaptiveConcurrency(ceiling)
+        else:
+            self._concurrency.set_ceiling(ceiling)
+        job.listener.on_concurrency(job.job_id, self._concurrency.limit)
+
+        # Primero todos los idiomas preferidos del lote, en el orden de los archivos
+        work = queue.PriorityQueue()
+        for sequence, unit in enumerate(units):
+            work.put((unit.rank, sequence, unit))
+
+        worker_count = max(1, min(self._concurrency.ceiling, len(units)))
+        workers = []
+        for _i in range(worker_count):
+            worker = threading.Thread(target=self._worker, args=(job, work, config))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+        if self._provider_stats is not None:
+            self._provider_stats.save()
+
+        job.listener.on_progress(job.job_id, 1.0, "\n¡Descarga completada!")
+
+    def _worker(self, job, work, config):
+        concurrency = self._concurrency
+        while True:
+            concurrency.acquire()
+            try:
+                _rank, _sequence, unit = work.get_nowait()
+            except queue.Empty:
+                concurrency.release()
+                return
+
+            entry = unit.entry
+            with job.lock:
+                progress = job.completed / job.total
+            job.listener.on_progress(
+                job.job_id,
+                progress,
+                f"Procesando: {entry.name} [{', '.join(unit.languages)}]"
+            )
+
+            success, congested, latency = self._download_unit(job, unit, config)
+
+            level = concurrency.release(latency, success, congested)
+            if level is not None:
+                job.listener.on_concurrency(job.job_id, level)
+
+            with job.lock:
+                entry.pending_units -= 1
+                if not success:
+                    entry.failed_units += 1
+                finished = entry.pending_units == 0
+
+            if finished:
+                self._finish_entry(job, entry, config)
+
+    def _finish_entry(self, job, entry, config):
+        """Cierra un vídeo cuando han terminado todas sus búsquedas"""
+        if entry.staged_path is not None:
+            shutil.rmtree(os.path.dirname(entry.staged_path), ignore_errors=True)
+            entry.staged_path = None
+
+        success = entry.failed_units == 0
+        shared = 0
+        if success and entry.duplicates:
+            shared = self._share_with_duplicates(job, entry, config)
+
+        with job.lock:
+            job.completed += 1 + len(entry.duplicates)
+            if success:
+                job.succeeded += 1 + shared
+                job.failed += len(entry.duplicates) - shared
+            else:
+                job.failed += 1 + len(entry.duplicates)
+
+    def _share_with_duplicates(self, job, entry, config):
+        """Reparte los subtítulos descargados entre los duplicados; devuelve cuántos tienen alguno"""
+        shared = 0
+        for duplicate in entry.duplicates:
+            names, existing = [], []
+            try:
+                names, existing = share_sidecars(entry, duplicate, entry.sidecars, config['force'])
+            except (OSError, GLib.Error) as e:
+                job.listener.on_log(job.job_id, f"✗ Error al copiar subtítulos a {duplicate.name}: {str(e)}")
+
+            if names:
+                job.listener.on_log(
+                    job.job_id,
+                    f"✓ Subtítulos de {entry.name} compartidos con {duplicate.name} ({len(names)} nuevos)"
+                )
+            elif existing or SubtitleIndex().sidecars(duplicate):
+                # Ya tenía sus propios subtítulos: no hay nada que copiar, pero no es un fallo
+                job.listener.on_log(job.job_id, f"✓ {duplicate.name} ya tiene subtítulos")
+            else:
+                job.listener.on_log(job.job_id, f"✗ Ningún subtítulo para {duplicate.name}")
+                continue
+
+            shared += 1
+        return shared
+
+    def build_command(self, config, filename, providers=None, languages=None):
+        """Construye la línea de órdenes de subliminal para un archivo
+
+        Por defecto usa los proveedores e idiomas de la configuración.
+        """
+        # Construir el comando base
+        cmd = self.subliminal_command + ['download']
+
+        # Añadir banderas opcionales
+        if config['force']:
+            cmd.append('--force')
+        if config['single']:
+            cmd.append('--single')
+        if config['hearing_impaired']:
+            cmd.append('--hearing-impaired')
+
+        # Añadir puntuación mínima
+        cmd.extend(['--min-score', str(config['min_score'])])
+
+        # Añadir proveedores (uno por uno)
+        for provider in providers or config['providers']:
+            cmd.extend(['--provider', provider])
+
+        # Añadir idiomas (cada uno como un argumento separado)
+        cmd.append('-l')
+        cmd.extend(languages or config['languages'])
+
+        # Añadir el archivo
+        cmd.append(filename)
+
+        # Filtrar cadenas vacías
+        return [arg for arg in cmd if arg]
+
+    def build_env(self, config):
+        """Prepara las variables de entorno con las credenciales de los proveedores"""
+        env = os.environ.copy()
+
+        # Configurar credenciales de OpenSubtitles
+        if config['open_subtitles_username'] and config['open_subtitles_password']:
+            env['SUBLIMINAL_OPENSUBTITLES_USERNAME'] = config['open_subtitles_username']
+            env['SUBLIMINAL_OPENSUBTITLES_PASSWORD'] = config['open_subtitles_password']
+
+        # Configurar credenciales de Addic7ed (si es necesario)
+        if config['addic7ed_username'] and config['addic7ed_password']:
+            env['SUBLIMINAL_ADDIC7ED_USERNAME'] = config['addic7ed_username']
+            env['SUBLIMINAL_ADDIC7ED_PASSWORD'] = config['addic7ed_password']
+
+        return env
+
+    def _run_subliminal(self, job, cmd, env):
+        """Ejecuta subliminal mostrando su salida; devuelve (código, congestión)"""
+        log = job.listener.on_log
+        congested = False
+
+        # Ejecutar el comando con las variables de entorno
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            env=env
+        )
+
+        # Leer la salida en tiempo real
+        for line in process.stdout:
+            congested = congested or bool(THROTTLE_PATTERN.search(line))
+            log(job.job_id, line.strip())
+
+        # Leer errores
+        for line in process.stderr:
+            congested = congested or bool(THROTTLE_PATTERN.search(line))
+            log(job.job_id, f"ERROR: {line.strip()}")
+
+        process.wait()
+        return process.returncode, congested
+
+    def _search_early_exit(self, job, filename, config, languages):
+        """Consulta los proveedores de uno en uno y para en cuanto hay subtítulos
+
+        Los proveedores se ordenan por aciertos por segundo según el historial
+        de los idiomas indicados. Si los primeros intentos no cubren todos los
+        idiomas, se puede recurrir a una búsqueda completa. Devuelve
+        (código, congestión, latencia). El código es 0 si se cubrieron todos
+        los idiomas y, si no, el de la última ejecución; la latencia es la
+        media de las consultas a un solo proveedor, sin la búsqueda completa.
+        """
+        log = job.listener.on_log
+        stats = self.provider_stats
+        env = self.build_env(config)
+        directory = os.path.dirname(filename)
+        stem = os.path.splitext(os.path.basename(filename))[0]
+
+        languages = list(languages)
+        providers = stats.order(config['providers'], languages)
+        attempts = max(1, int(config.get('early_exit_attempts', 2)))
+        returncode = 0
+        congested = False
+        throttled_providers = []
+        latencies = []
+
+        for provider in providers[:attempts]:
+            before = list_sidecars(directory, stem)
+            started = time.monotonic()
+            code, throttled = self._run_subliminal(
+                job,
+                self.build_command(config, filename, providers=[provider], languages=languages),
+                env
+            )
+            latency = time.monotonic() - started
+            latencies.append(latency)
+            changed = changed_sidecars(before, list_sidecars(directory, stem))
+
+            returncode = code
+            congested = congested or throttled
+            if throttled:
+                throttled_providers.append(provider)
+
+            # Con --single el subtítulo no lleva idioma: cualquiera cubre la búsqueda
+            if config['single']:
+                found = set(languages) if changed else set()
+            else:
+                found = {sidecar_language(name, stem) for name in changed}
+            stats.record(provider, languages, found, latency)
+
+            languages = [language for language in languages if language not in found]
+            if not languages:
+                log(job.job_id, f"Búsqueda terminada en {provider}")
+                return 0, congested, sum(latencies) / len(latencies)
+
+        # Búsqueda completa con los proveedores que no se han descartado ya
+        fallback = [
+            provider for provider in providers
+            if provider not in providers[:attempts] or provider in throttled_providers
+        ]
+        if config.get('early_exit_fallback', True) and fallback:
+            log(job.job_id, f"Búsqueda completa en {', '.join(fallback)}")
+            code, throttled = self._run_subliminal(
+                job,
+                self.build_command(config, filename, providers=fallback, languages=languages),
+                env
+            )
+            returncode = code
+            congested = congested or throttled
+
+        return returncode, congested, sum(latencies) / len(latencies)
+
+    def _local_filename(self, entry):
+        """Ruta local sobre la que ejecutar subliminal; prepara una copia si el vídeo es remoto"""
+        if entry.path is not None:
+            return entry.path
+
+        with entry.lock:
+            if entry.staged_path is None:
+                entry.staged_path = stage_remote_file(entry)
+            return entry.staged_path
+
+    def _download_unit(self, job, unit, config):
+        """Descarga los subtítulos de un vídeo en los idiomas de la búsqueda
+
+        Devuelve (éxito, congestión, latencia). La latencia mide solo la
+        búsqueda, sin la copia local de los vídeos remotos.
+        """
+        log = job.listener.on_log
+        entry = unit.entry
+        label = f"{entry.name} [{', '.join(unit.languages)}]"
+
         try:
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(config, f, indent=4)
-            return True
+            filename = self._local_filename(entry)
+
+            if config.get('search_mode') == 'early_exit':
+                returncode, congested, latency = self._search_early_exit(
+                    job, filename, config, unit.languages
+                )
+            else:
+                started = time.monotonic()
+                returncode, congested = self._run_subliminal(
+                    job,
+                    self.build_command(config, filename, languages=unit.languages),
+                    self.build_env(config)
+                )
+                latency = time.monotonic() - started
+
+            if entry.staged_path is not None:
+                # Ubicación remota sin ruta FUSE: copiar los subtítulos junto al vídeo
+                published = publish_staged_sidecars(entry, filename)
+                with entry.lock:
+                    entry.sidecars = sorted(set(entry.sidecars) | set(published))
+            else:
+                stem = os.path.splitext(entry.name)[0]
+                sidecars = sorted(list_sidecars(os.path.dirname(filename), stem))
+                with entry.lock:
+                    entry.sidecars = sidecars
         except Exception as e:
-            self.log_error(f"Error al guardar la configuración: {str(e)}")
-            return False
-    
-    def log_error(self, message):
-        """Registra un mensaje de error en el archivo de registro"""
+            log(job.job_id, f"✗ Error al procesar {label}: {str(e)}")
+            return False, False, 0.0
+
+        if returncode == 0:
+            log(job.job_id, f"✓ Subtítulos descargados para {label}")
+            return True, congested, latency
+
+        log(job.job_id, f"✗ Error al descargar subtítulos para {label}")
+        return False, congested, latency
+
+
+class DBusJobListener(JobListener):
+    """Envía los eventos de un trabajo como señales D-Bus dirigidas al cliente que lo pidió"""
+
+    def __init__(self, connection, destination):
+        self.connection = connection
+        self.destination = destination
+
+    def _emit(self, signal, variant):
         try:
-            with open(LOG_FILE, 'a') as f:
-                f.write(f"{message}\n")
-        except:
-            pass
-    
-    def show_error_dialog(self, parent, message):
-        """Muestra un diálogo de error"""
-        dialog = Gtk.MessageDialog(
-            transient_for=parent,
-            flags=0,
-            message_type=Gtk.MessageType.ERROR,
-            buttons=Gtk.ButtonsType.CLOSE,
-            text=_("Error")
+            self.connection.emit_signal(self.destination, DBUS_PATH, DBUS_INTERFACE, signal, variant)
+        except GLib.Error as e:
+            log_error(f"Error al emitir la señal {signal}: {e.message}")
+
+    def on_progress(self, job_id, fraction, message):
+        self._emit('Progress', GLib.Variant('(uds)', (job_id, fraction, message)))
+
+    def on_log(self, job_id, line):
+        self._emit('Log', GLib.Variant('(us)', (job_id, line)))
+
+    def on_concurrency(self, job_id, level):
+        self._emit('Concurrency', GLib.Variant('(uu)', (job_id, level)))
+
+    def on_finished(self, job_id, succeeded, failed):
+        self._emit('Finished', GLib.Variant('(uuu)', (job_id, succeeded, failed)))
+
+
+class SubliminalService:
+    """Servicio D-Bus de sesión que mantiene la cola de descargas en un solo proceso
+
+    Los clientes comparten así la cola y el límite de concurrencia de un único
+    SubliminalPipeline.
+    """
+
+    def __init__(self, pipeline, persist=False):
+        self.pipeline = pipeline
+        self.persist = persist
+        self.loop = GLib.MainLoop()
+        self.exit_code = 0
+        self._registration_id = None
+        self._last_busy = GLib.get_monotonic_time()
+
+    def run(self):
+        """Publica el servicio y atiende peticiones hasta quedar inactivo"""
+        owner_id = Gio.bus_own_name(
+            Gio.BusType.SESSION,
+            DBUS_NAME,
+            Gio.BusNameOwnerFlags.NONE,
+            self._on_bus_acquired,
+            None,
+            self._on_name_lost
         )
-        dialog.format_secondary_text(message)
-        dialog.run()
-        dialog.destroy()
-    
-    def show_progress_dialog(self, parent, files):
-        """Muestra un diálogo con el progreso de la descarga"""
-        dialog = Gtk.Dialog(
+
+        if not self.persist:
+            GLib.timeout_add_seconds(30, self._check_idle)
+
+        self.loop.run()
+        Gio.bus_unown_name(owner_id)
+        return self.exit_code
+
+    def _on_bus_acquired(self, connection, name):
+        node_info = Gio.DBusNodeInfo.new_for_xml(DBUS_XML)
+        self._registration_id = connection.register_object(
+            DBUS_PATH,
+            node_info.interfaces[0],
+            self._on_method_call,
+            None,
+            None
+        )
+
+    def _on_name_lost(self, connection, name):
+        # Otro proceso ya ofrece el servicio o no hay bus de sesión
+        log_error(f"No se pudo obtener el nombre D-Bus {name}")
+        self.exit_code = 1
+        self.loop.quit()
+
+    def _on_method_call(self, connection, sender, object_path, interface_name,
+                        method_name, parameters, invocation):
+        if method_name == 'Download':
+            uris = parameters.unpack()[0]
+            job = self.pipeline.create_job(
+                uris,
+                DBusJobListener(connection, invocation.get_sender())
+            )
+            invocation.return_value(GLib.Variant('(u)', (job.job_id,)))
+
+            # Encolar después de responder para que las señales lleguen tras la respuesta
+            self.pipeline.enqueue(job)
+        else:
+            invocation.return_dbus_error(
+                'org.freedesktop.DBus.Error.UnknownMethod',
+                f"Método desconocido: {method_name}"
+            )
+
+    def _check_idle(self):
+        now = GLib.get_monotonic_time()
+        if not self.pipeline.is_idle():
+            self._last_busy = now
+        elif now - self._last_busy >= SERVICE_IDLE_TIMEOUT * 1000000:
+            self.loop.quit()
+            return False
+        return True
+
+
+class SubliminalClient:
+    """Envía trabajos al servicio D-Bus o, si no está disponible, los ejecuta en este proceso
+
+    Los eventos llegan al listener siempre desde el bucle principal de GLib.
+    Si el servicio desaparece con trabajos pendientes, estos se dan por
+    fallidos para que ninguna ventana ni la CLI esperen indefinidamente.
+    """
+
+    def __init__(self):
+        self._connection = None
+        self._listeners = {}
+        self._local_pipeline = None
+        self._service_running = False
+
+    def _get_connection(self):
+        if self._connection is None:
+            connection = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+            for signal in ('Progress', 'Log', 'Concurrency', 'Finished'):
+                connection.signal_subscribe(
+                    None,
+                    DBUS_INTERFACE,
+                    signal,
+                    DBUS_PATH,
+                    None,
+                    Gio.DBusSignalFlags.NONE,
+                    self._on_signal
+                )
+            Gio.bus_watch_name_on_connection(
+                connection,
+                DBUS_NAME,
+                Gio.BusNameWatcherFlags.NONE,
+                self._on_service_appeared,
+                self._on_service_vanished
+            )
+            self._connection = connection
+        return self._connection
+
+    def _on_service_appeared(self, connection, name, owner):
+        self._service_running = True
+
+    def _on_service_vanished(self, connection, name):
+        if not self._service_running:
+            return
+        self._service_running = False
+
+        # Los trabajos en curso no recibirán la señal Finished
+        listeners = self._listeners
+        self._listeners = {}
+        for job_id, (listener, total) in listeners.items():
+            listener.on_log(job_id, "✗ El servicio de descargas terminó de forma inesperada")
+            listener.on_finished(job_id, 0, total)
+
+    def submit(self, uris, listener, local=False):
+        """Envía las URIs como un nuevo trabajo"""
+        if not local:
+            try:
+                self._get_connection().call(
+                    DBUS_NAME,
+                    DBUS_PATH,
+                    DBUS_INTERFACE,
+                    'Download',
+                    GLib.Variant('(as)', (list(uris),)),
+                    GLib.VariantType.new('(u)'),
+                    Gio.DBusCallFlags.NONE,
+                    -1,
+                    None,
+                    self._on_download_reply,
+                    (uris, listener)
+                )
+                return
+            except GLib.Error as e:
+                log_error(f"Bus de sesión no disponible: {e.message}")
+
+        self._submit_local(uris, listener)
+
+    def _submit_local(self, uris, listener):
+        if self._local_pipeline is None:
+            self._local_pipeline = SubliminalPipeline()
+        self._local_pipeline.submit(uris, MainLoopListener(listener))
+
+    def _on_download_reply(self, connection, result, data):
+        uris, listener = data
+        try:
+            job_id = connection.call_finish(result).unpack()[0]
+        except GLib.Error as e:
+            log_error(f"Servicio D-Bus no disponible, se usa la cola local: {e.message}")
+            self._submit_local(uris, listener)
+            return
+
+        self._listeners[job_id] = (listener, len(uris))
+
+    def _on_signal(self, connection, sender_name, object_path, interface_name,
+                   signal_name, parameters):
+        args = parameters.unpack()
+        if args[0] not in self._listeners:
+            return
+
+        listener = self._listeners[args[0]][0]
+
+        if signal_name == 'Progress':
+            listener.on_progress(*args)
+        elif signal_name == 'Log':
+            listener.on_log(*args)
+        elif signal_name == 'Concurrency':
+            listener.on_concurrency(*args)
+        elif signal_name == 'Finished':
+            del self._listeners[args[0]]
+            listener.on_finished(*args)
+
+
+# Sin Nemo (CLI o servicio D-Bus) la extensión no se registra
+MenuProvider = Nemo.MenuProvider if Nemo is not None else object
+
+
+def send_notification(notification_id, title, body):
+    """Envía una notificación de escritorio a través de la aplicación en ejecución"""
+    application = Gio.Application.get_default()
+    if application is None:
+        log_error(f"{title}: {body}")
+        return
+
+    notification = Gio.Notification.new(title)
+    notification.set_body(body)
+    notification.set_icon(Gio.ThemedIcon.new('video-x-generic'))
+    application.send_notification(notification_id, notification)
+
+
+class ProgressDialog(Gtk.Dialog, JobListener):
+    """Ventana no modal con el progreso de un trabajo en segundo plano
+
+    Mientras el trabajo sigue en curso, cerrarla solo la oculta; se puede
+    volver a abrir desde el menú contextual del fondo. Si sigue oculta al
+    terminar, se descarta tras enviar la notificación.
+    """
+
+    def __init__(self, parent, description, on_closed):
+        super().__init__(
             title=_("Descargando subtítulos"),
             flags=0
         )
-        
+
         # Si tenemos una ventana padre, la configuramos como transitoria
         if parent is not None:
-            dialog.set_transient_for(parent)
-        dialog.set_default_size(400, 300)
-        
+            self.set_transient_for(parent)
+        self.set_default_size(400, 300)
+
+        self.description = description
+        self.status = _("En curso")
+        self.finished = False
+        self._on_closed = on_closed
+
         # Configurar la ventana
-        content_area = dialog.get_content_area()
+        content_area = self.get_content_area()
         content_area.set_spacing(6)
-        
+
         # Barra de progreso
         progress_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
-        progress_bar = Gtk.ProgressBar()
-        progress_box.pack_start(progress_bar, False, False, 6)
-        
+        self.progress_bar = Gtk.ProgressBar()
+        progress_box.pack_start(self.progress_bar, False, False, 6)
+
+        # Descargas simultáneas elegidas por el control adaptativo
+        self.concurrency_label = Gtk.Label()
+        self.concurrency_label.set_halign(Gtk.Align.START)
+        progress_box.pack_start(self.concurrency_label, False, False, 0)
+
         # Área de texto para el registro
         scrolled_window = Gtk.ScrolledWindow()
         scrolled_window.set_hexpand(True)
         scrolled_window.set_vexpand(True)
-        
-        text_view = Gtk.TextView()
-        text_view.set_editable(False)
-        text_view.set_wrap_mode(Gtk.WrapMode.WORD)
-        text_view.set_monospace(True)
-        
+
+        self.text_view = Gtk.TextView()
+        self.text_view.set_editable(False)
+        self.text_view.set_wrap_mode(Gtk.WrapMode.WORD)
+        self.text_view.set_monospace(True)
+
         # Configurar fuente monoespaciada
         font_desc = Pango.FontDescription("Monospace 9")
-        text_view.override_font(font_desc)
-        
-        scrolled_window.add(text_view)
-        
-        # Botón de cerrar
-        close_button = dialog.add_button(_("Cerrar"), Gtk.ResponseType.CLOSE)
-        close_button.set_sensitive(False)
-        
+        self.text_view.override_font(font_desc)
+
+        scrolled_window.add(self.text_view)
+
+        # Botón de cerrar (oculta la ventana si el trabajo no ha terminado)
+        self.add_button(_("Cerrar"), Gtk.ResponseType.CLOSE)
+        self.connect('response', self._on_response)
+        self.connect('delete-event', self._on_delete_event)
+
         content_area.pack_start(progress_box, False, False, 6)
         content_area.pack_start(scrolled_window, True, True, 6)
+
+        self.show_all()
+
+    def _on_response(self, dialog, response):
+        self.dismiss()
+
+    def _on_delete_event(self, widget, event):
+        self.dismiss()
+        return True
+
+    def dismiss(self):
+        """Oculta la ventana o, si el trabajo ha terminado, la destruye"""
+        if not self.finished:
+            self.hide()
+            return
+
+        self._on_closed(self)
+        self.destroy()
+
+    def append_log(self, text):
+        buffer = self.text_view.get_buffer()
+        end_iter = buffer.get_end_iter()
+        buffer.insert(end_iter, f"{text}\n")
+
+        # Desplazarse al final
+        mark = buffer.create_mark(None, end_iter, False)
+        self.text_view.scroll_to_mark(mark, 0.0, True, 0.0, 1.0)
+
+    @instrumented('progress_dialog_update')
+    def on_progress(self, job_id, fraction, message):
+        self.progress_bar.set_fraction(fraction)
+        self.append_log(message)
+
+    @instrumented('progress_dialog_update')
+    def on_log(self, job_id, line):
+        self.append_log(line)
+
+    @instrumented('progress_dialog_update')
+    def on_concurrency(self, job_id, level):
+        self.concurrency_label.set_text(_("Descargas simultáneas: {}").format(level))
+
+    @instrumented('progress_dialog_update')
+    def on_finished(self, job_id, succeeded, failed):
+        self.finished = True
+        self.status = _("Correctos: {}, con errores: {}").format(succeeded, failed)
+        self.set_title(_("Descarga de subtítulos completada"))
+        self.progress_bar.set_fraction(1.0)
+
+        send_notification(
+            f"subliminal-nemo-{id(self)}",
+            _("Descarga de subtítulos completada") if failed == 0
+            else _("Descarga de subtítulos completada con errores"),
+            f"{self.description}\n{self.status}"
+        )
+
+        # Ventana oculta: la notificación ya informa del resultado
+        if not self.get_visible():
+            self.dismiss()
+
+
+def describe_files(files):
+    """Texto corto que identifica una selección de archivos en menús y notificaciones"""
+    if not files:
+        return _("Sin archivos")
+
+    name = files[0].get_name()
+    if len(files) == 1:
+        return name
+    return _("{} y {} más").format(name, len(files) - 1)
+
+
+class SubliminalExtension(GObject.GObject, MenuProvider):
+    def __init__(self):
+        setup_directories()
+        self.config = load_config()
+        self.client = SubliminalClient()
         
-        dialog.show_all()
-        
-        # Iniciar la descarga en segundo plano
-        self.start_download(dialog, files, progress_bar, text_view, close_button)
+        # Ventanas de progreso de los trabajos en curso o pendientes de cerrar
+        self.jobs = []
         
-        # Manejar la respuesta del diálogo
-        response = dialog.run()
-        if response == Gtk.ResponseType.CLOSE:
-            dialog.destroy()
+        if self.config.get('debug_instrumentation') or os.environ.get('SUBLIMINAL_NEMO_DEBUG') == '1':
+            instrumentation.enable()
+            instrumentation.start_heartbeat()
+            GLib.timeout_add_seconds(INSTRUMENTATION_REPORT_INTERVAL, instrumentation.log_report)
     
-    def start_download(self, dialog, files, progress_bar, text_view, close_button):
-        """Inicia el proceso de descarga en segundo plano"""
-        def append_log(text):
-            buffer = text_view.get_buffer()
-            end_iter = buffer.get_end_iter()
-            buffer.insert(end_iter, f"{text}\n")
-            
-            # Desplazarse al final
-            mark = buffer.create_mark(None, end_iter, False)
-            text_view.scroll_to_mark(mark, 0.0, True, 0.0, 1.0)
+    def show_error_dialog(self, parent, message):
+        """Muestra un diálogo de error"""
+        dialog = Gtk.MessageDialog(
+            transient_for=parent,
+            flags=0,
+            message_type=Gtk.MessageType.ERROR,
+            buttons=Gtk.ButtonsType.CLOSE,
+            text=_("Error")
+        )
+        dialog.format_secondary_text(message)
+        dialog.run()
+        dialog.destroy()
+    
+    def show_progress_dialog(self, parent, files):
+        """Abre una ventana de progreso no modal y lanza la descarga en segundo plano"""
+        dialog = ProgressDialog(parent, describe_files(files), self._on_progress_dialog_closed)
+        self.jobs.append(dialog)
         
-        def update_progress(progress, message):
-            progress_bar.set_fraction(progress)
-            append_log(message)
-            
-            # Actualizar la interfaz
-            while Gtk.events_pending():
-                Gtk.main_iteration_do(False)
-        
-        def download_thread():
-            total_files = len(files)
-            for i, file_info in enumerate(files):
-                if file_info.get_uri_scheme() != 'file':
-                    continue
-                
-                filename = file_info.get_location().get_path()
-                if not os.path.isfile(filename):
-                    continue
-                
-                # Actualizar progreso
-                progress = i / total_files
-                update_progress(progress, f"Procesando: {os.path.basename(filename)}")
-                
-                # Construir el comando base
-                cmd = ['subliminal', 'download']
-                
-                # Añadir banderas opcionales
-                if self.config['force']:
-                    cmd.append('--force')
-                if self.config['single']:
-                    cmd.append('--single')
-                if self.config['hearing_impaired']:
-                    cmd.append('--hearing-impaired')
-                
-                # Añadir puntuación mínima
-                cmd.extend(['--min-score', str(self.config['min_score'])])
-                
-                # Añadir proveedores (uno por uno)
-                for provider in self.config['providers']:
-                    cmd.extend(['--provider', provider])
-                
-                # Configurar credenciales como variables de entorno
-                env = os.environ.copy()
-                
-                # Configurar credenciales de OpenSubtitles
-                if self.config['open_subtitles_username'] and self.config['open_subtitles_password']:
-                    env['SUBLIMINAL_OPENSUBTITLES_USERNAME'] = self.config['open_subtitles_username']
-                    env['SUBLIMINAL_OPENSUBTITLES_PASSWORD'] = self.config['open_subtitles_password']
-                
-                # Configurar credenciales de Addic7ed (si es necesario)
-                if self.config['addic7ed_username'] and self.config['addic7ed_password']:
-                    env['SUBLIMINAL_ADDIC7ED_USERNAME'] = self.config['addic7ed_username']
-                    env['SUBLIMINAL_ADDIC7ED_PASSWORD'] = self.config['addic7ed_password']
-                
-                # Añadir idiomas (cada uno como un argumento separado)
-                cmd.append('-l')
-                cmd.extend(self.config['languages'])
-                
-                # Añadir el archivo
-                cmd.append(filename)
-                
-                # Filtrar cadenas vacías
-                cmd = [arg for arg in cmd if arg]
-                
-                try:
-                    # Ejecutar el comando con las variables de entorno
-                    process = subprocess.Popen(
-                        cmd,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        universal_newlines=True,
-                        env=env
-                    )
-                    
-                    # Leer la salida en tiempo real
-                    for line in process.stdout:
-                        append_log(line.strip())
-                    
-                    # Leer errores
-                    for line in process.stderr:
-                        append_log(f"ERROR: {line.strip()}")
-                    
-                    process.wait()
-                    
-                    if process.returncode == 0:
-                        append_log(f"✓ Subtítulos descargados para {os.path.basename(filename)}")
-                    else:
-                        append_log(f"✗ Error al descargar subtítulos para {os.path.basename(filename)}")
-                    
-                except Exception as e:
-                    append_log(f"✗ Error al procesar {os.path.basename(filename)}: {str(e)}")
-            
-            # Actualizar la interfaz al finalizar
-            GLib.idle_add(update_progress, 1.0, "\n¡Descarga completada!")
-            GLib.idle_add(close_button.set_sensitive, True)
-        
-        # Iniciar el hilo de descarga
-        import threading
-        thread = threading.Thread(target=download_thread)
-        thread.daemon = True
-        thread.start()
+        # Iniciar la descarga en segundo plano; el callback vuelve inmediatamente
+        self.start_download(dialog, files)
+    
+    def start_download(self, dialog, files):
+        """Envía la descarga a la cola compartida y muestra su progreso en la ventana"""
+        uris = [file_info.get_uri() for file_info in files]
+        self.client.submit(uris, dialog)
+    
+    def _on_progress_dialog_closed(self, dialog):
+        """Olvida la ventana de un trabajo terminado al cerrarla"""
+        if dialog in self.jobs:
+            self.jobs.remove(dialog)
     
     def show_config_dialog(self, parent):
         """Muestra el diálogo de configuración"""
-        dialog = SubliminalConfigDialog(parent, self.config)
+        with instrumentation.measure('config_dialog_init'):
+            dialog = SubliminalConfigDialog(parent, self.config)
         
         # Si no hay ventana padre, centrar el diálogo en la pantalla
         if parent is None:
@@ -781,31 +2367,41 @@ class SubliminalExtension(GObject.GObject, Nemo.MenuProvider):
             new_config = dialog.get_config()
             if new_config != self.config:
                 self.config = new_config
-                self.save_config(self.config)
+                save_config(self.config)
     
+    @instrumented('menu_activate_cb')
     def menu_activate_cb(self, menu, files):
         """Maneja la activación del menú"""
         # En Nemo, no podemos obtener fácilmente la ventana principal desde el menú
         # Pasamos None como ventana principal
         self.show_progress_dialog(None, files)
     
+    @instrumented('job_activate_cb')
+    def job_activate_cb(self, menu, dialog):
+        """Vuelve a mostrar la ventana de progreso de un trabajo"""
+        dialog.present()
+    
     def config_activate_cb(self, menu):
-        """Maneja la activación de la opción de configuración"""
+        """Maneja la activación de la opción de configuración
+
+        No se mide entera: dialog.run() espera a que el usuario cierre el
+        diálogo. Su construcción se mide en show_config_dialog.
+        """
         # En Nemo, no podemos obtener fácilmente la ventana principal desde el menú
         # Pasamos None como ventana principal
         self.show_config_dialog(None)
     
+    @instrumented('get_file_items')
     def get_file_items(self, window, files):
         """Devuelve los elementos del menú contextual para archivos"""
         # Solo mostrar para archivos de video
-        video_extensions = ('.mkv', '.mp4', '.avi', '.mov', '.wmv', '.flv', '.m4v', '.mpg', '.mpeg')
-        
         for file_info in files:
             if file_info.is_gone() or file_info.is_directory():
                 return []
             
-            file_path = file_info.get_location().get_path()
-            if not file_path or not file_path.lower().endswith(video_extensions):
+            # get_name() también funciona en ubicaciones remotas (smb://, sftp://)
+            file_name = file_info.get_name()
+            if not file_name or not file_name.lower().endswith(VIDEO_EXTENSIONS):
                 return []
         
         # Crear el elemento de menú principal
@@ -818,6 +2414,7 @@ class SubliminalExtension(GObject.GObject, Nemo.MenuProvider):
         
         return [menu_item]
     
+    @instrumented('get_background_items')
     def get_background_items(self, window, file):
         """Devuelve los elementos del menú contextual para el fondo"""
         # Crear el elemento de menú de configuración
@@ -827,5 +2424,280 @@ class SubliminalExtension(GObject.GObject, Nemo.MenuProvider):
             tip=_('Configurar las opciones de Subliminal')
         )
         menu_item.connect('activate', self.config_activate_cb)
+        items = [menu_item]
+        
+        # Submenú con los trabajos en segundo plano
+        if self.jobs:
+            jobs_item = Nemo.MenuItem(
+                name='Subliminal::jobs',
+                label=_('Descargas de subtítulos'),
+                tip=_('Mostrar el progreso de las descargas en segundo plano')
+            )
+            submenu = Nemo.Menu()
+            jobs_item.set_submenu(submenu)
+            
+            for index, dialog in enumerate(self.jobs):
+                job_item = Nemo.MenuItem(
+                    name=f'Subliminal::job_{index}',
+                    label=f"{dialog.description} ({dialog.status})",
+                    tip=_('Mostrar la ventana de progreso')
+                )
+                job_item.connect('activate', self.job_activate_cb, dialog)
+                submenu.append_item(job_item)
+            
+            items.append(jobs_item)
         
-        return [menu_item]
+        return items
+
+
+class ConsoleListener(JobListener):
+    """Muestra los eventos de un trabajo en la terminal y termina el bucle al acabar"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.failed = 0
+
+    def on_progress(self, job_id, fraction, message):
+        print(f"[{int(fraction * 100):3d}%] {message.strip()}", flush=True)
+
+    def on_log(self, job_id, line):
+        if line:
+            print(line, flush=True)
+
+    def on_concurrency(self, job_id, level):
+        print(f"Descargas simultáneas: {level}", flush=True)
+
+    def on_finished(self, job_id, succeeded, failed):
+        print(f"Correctos: {succeeded}, con errores: {failed}", flush=True)
+        self.failed = failed
+        self.loop.quit()
+
+
+def collect_video_uris(paths):
+    """Convierte los argumentos en URIs, recorriendo los directorios en busca de vídeos"""
+    uris = []
+    for arg in paths:
+        location = Gio.File.new_for_commandline_arg(arg)
+        path = location.get_path()
+
+        if path and os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        uris.append(Path(root, name).as_uri())
+        else:
+            uris.append(location.get_uri())
+    return uris
+
+
+def fake_subliminal(delay, arguments):
+    """Sustituto de «subliminal download» para pruebas: espera y escribe subtítulos vacíos"""
+    if not arguments or arguments[0] != 'download':
+        print("Uso: fake-subliminal [--delay S] download [opciones] -l IDIOMAS... ARCHIVO", file=sys.stderr)
+        return 2
+
+    filename = arguments[-1]
+    languages = []
+    if '-l' in arguments:
+        languages = arguments[arguments.index('-l') + 1:-1]
+
+    time.sleep(delay)
+
+    stem = os.path.splitext(filename)[0]
+    alpha2 = {alpha3: code for code, alpha3 in LANGUAGE_ALPHA3.items()}
+    if '--single' in arguments:
+        names = [f"{stem}.srt"]
+    else:
+        names = [f"{stem}.{alpha2.get(language, language)}.srt" for language in languages]
+
+    for name in names:
+        with open(name, 'w') as f:
+            f.write("1\n00:00:01,000 --> 00:00:02,000\n...\n")
+
+    print(f"Downloaded {len(names)} subtitle(s)")
+    return 0
+
+
+class BenchmarkListener(JobListener):
+    """Reenvía los eventos a la ventana de progreso y termina el bucle al acabar"""
+
+    def __init__(self, dialog, loop):
+        self.dialog = dialog
+        self.loop = loop
+
+    def on_progress(self, job_id, fraction, message):
+        self.dialog.on_progress(job_id, fraction, message)
+
+    def on_log(self, job_id, line):
+        self.dialog.on_log(job_id, line)
+
+    def on_concurrency(self, job_id, level):
+        self.dialog.on_concurrency(job_id, level)
+
+    def on_finished(self, job_id, succeeded, failed):
+        self.dialog.on_finished(job_id, succeeded, failed)
+        self.loop.quit()
+
+
+def run_benchmark(files, delay, dialogs, budget_ms):
+    """Escenario sin interfaz real (p. ej. con xvfb-run): descarga con el sustituto de
+    subliminal mientras se construyen diálogos de configuración, y falla si el p99 del
+    retraso del bucle principal supera el presupuesto"""
+    if not Gtk.init_check(None)[0]:
+        print(_("Se necesita una pantalla; ejecútalo con xvfb-run"), file=sys.stderr)
+        return 2
+
+    os.environ[SUBLIMINAL_COMMAND_ENV] = " ".join(shlex.quote(arg) for arg in [
+        sys.executable, os.path.abspath(__file__), 'fake-subliminal', '--delay', str(delay)
+    ])
+
+    workdir = tempfile.mkdtemp(prefix='subliminal-nemo-bench-')
+    uris = []
+    for index in range(files):
+        path = Path(workdir, f"video-{index:04d}.mkv")
+        path.write_bytes(index.to_bytes(4, 'little') * 1024)
+        uris.append(path.as_uri())
+
+    instrumentation.enable()
+    instrumentation.start_heartbeat()
+
+    loop = GLib.MainLoop()
+    dialog = ProgressDialog(None, _("Banco de pruebas"), lambda closed: None)
+    config = DEFAULT_CONFIG.copy()
+    config['single'] = False
+    config['deduplicate'] = False
+    SubliminalPipeline(config).submit(uris, MainLoopListener(BenchmarkListener(dialog, loop)))
+
+    # Construir diálogos de configuración mientras avanza la descarga
+    remaining = [dialogs]
+
+    def build_config_dialog():
+        with instrumentation.measure('config_dialog_init'):
+            config_dialog = SubliminalConfigDialog(None, config)
+        config_dialog.destroy()
+        remaining[0] -= 1
+        return remaining[0] > 0
+
+    if dialogs > 0:
+        GLib.timeout_add(250, build_config_dialog)
+
+    loop.run()
+
+    instrumentation.stop_heartbeat()
+    dialog.destroy()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(instrumentation.format_report())
+    stall_p99 = instrumentation.report()['main_loop_stall']['p99']
+    if stall_p99 > budget_ms:
+        print(f"✗ p99 del retraso del bucle principal: {stall_p99:.1f}ms > {budget_ms:.1f}ms")
+        return 1
+
+    print(f"✓ p99 del retraso del bucle principal: {stall_p99:.1f}ms <= {budget_ms:.1f}ms")
+    return 0
+
+
+def main(argv=None):
+    """Punto de entrada sin interfaz: descargas por lotes, servicio D-Bus y banco de pruebas"""
+    parser = argparse.ArgumentParser(
+        prog='subliminal-nemo',
+        description=_("Descarga subtítulos con la misma cola que la extensión de Nemo")
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    download_parser = subparsers.add_parser(
+        'download',
+        help=_("Descargar subtítulos para archivos o directorios")
+    )
+    download_parser.add_argument('paths', nargs='+', help=_("Archivos, directorios o URIs"))
+    download_parser.add_argument(
+        '--local',
+        action='store_true',
+        help=_("Procesar en este proceso sin usar el servicio D-Bus")
+    )
+
+    serve_parser = subparsers.add_parser('serve', help=_("Ejecutar el servicio D-Bus de sesión"))
+    serve_parser.add_argument(
+        '--persist',
+        action='store_true',
+        help=_("No terminar al quedar inactivo")
+    )
+
+    bench_parser = subparsers.add_parser(
+        'bench',
+        help=_("Medir la respuesta de la interfaz con un sustituto de subliminal")
+    )
+    bench_parser.add_argument('--files', type=int, default=200, help=_("Vídeos simulados"))
+    bench_parser.add_argument(
+        '--delay',
+        type=float,
+        default=0.05,
+        help=_("Segundos que tarda cada descarga simulada")
+    )
+    bench_parser.add_argument(
+        '--dialogs',
+        type=int,
+        default=5,
+        help=_("Diálogos de configuración construidos durante la prueba")
+    )
+    bench_parser.add_argument(
+        '--budget-ms',
+        type=float,
+        default=50.0,
+        help=_("Máximo admitido para el p99 del retraso del bucle principal")
+    )
+
+    subparsers.add_parser(
+        'install-service',
+        help=_("Instalar el archivo de activación D-Bus del servicio")
+    )
+    subparsers.add_parser(
+        'uninstall-service',
+        help=_("Eliminar el archivo de activación D-Bus del servicio")
+    )
+
+    fake_parser = subparsers.add_parser(
+        'fake-subliminal',
+        help=_("Sustituto de subliminal usado por el banco de pruebas")
+    )
+    fake_parser.add_argument('--delay', type=float, default=0.05)
+    fake_parser.add_argument('arguments', nargs=argparse.REMAINDER)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'fake-subliminal':
+        return fake_subliminal(args.delay, args.arguments)
+
+    setup_directories()
+
+    if args.command == 'bench':
+        return run_benchmark(args.files, args.delay, args.dialogs, args.budget_ms)
+
+    if args.command == 'install-service':
+        if not install_dbus_service():
+            return 1
+        print(_("Servicio instalado en {}").format(DBUS_SERVICE_FILE))
+        return 0
+
+    if args.command == 'uninstall-service':
+        return 0 if uninstall_dbus_service() else 1
+
+    if args.command == 'serve':
+        return SubliminalService(SubliminalPipeline(), persist=args.persist).run()
+
+    uris = collect_video_uris(args.paths)
+    if not uris:
+        print(_("No se encontraron archivos de vídeo"), file=sys.stderr)
+        return 1
+
+    loop = GLib.MainLoop()
+    listener = ConsoleListener(loop)
+    SubliminalClient().submit(uris, listener, local=args.local)
+    loop.run()
+
+    return 0 if listener.failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())